@@ -1,15 +1,23 @@
 import sys
+import re
+import json
+import string
+import time
 import zipfile
 import shutil
+import tempfile
+import multiprocessing
 import openpyxl
 from pathlib import Path
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QPixmap
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from PyQt5.QtCore import Qt, QBuffer, QIODevice
+from PyQt5.QtGui import QPixmap, QImage
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QPushButton, QLabel, QVBoxLayout, QHBoxLayout,
     QFileDialog, QComboBox, QCheckBox, QMessageBox, QGroupBox, QGridLayout, 
     QDialog, QLineEdit, QScrollArea, QMainWindow, QAction, QStackedLayout,
-    QSpacerItem, QSizePolicy
+    QSpacerItem, QSizePolicy, QPlainTextEdit, QInputDialog,
+    QProgressDialog
 )
 from PyQt5.QtWidgets import QDateEdit
 from PyQt5.QtCore import QDate
@@ -93,6 +101,325 @@ def get_photonotes_thumbnails(photo_notes_dir):
     return thumbnails
 
 
+# v2.1 - rule-based bulk rename
+RENAME_JOURNAL_NAME = ".is2tool_rename_journal.json"
+_INVALID_NAME_CHARS = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+_PATTERN_FIELD = re.compile(r"tier\d+|location|seq|original")
+
+
+class RenameRecoveryError(Exception):
+    """A bulk rename could not be rolled back and its journal needs recover_bulk_rename."""
+
+
+class _PatternFields(dict):
+    # Unknown placeholders (e.g. {tier4} on a 3-tier sheet) render as empty text
+    def __missing__(self, key):
+        return ""
+
+
+def _check_pattern(pattern):
+    # Only plain fields are allowed, so "{original.x}" or "{seq[0]}" can't reach format_map
+    for _, field_name, format_spec, _ in string.Formatter().parse(pattern):
+        if field_name is not None and not _PATTERN_FIELD.fullmatch(field_name):
+            raise ValueError(f"Unknown field {{{field_name}}}")
+        if format_spec and "{" in format_spec:
+            raise ValueError(f"Nested fields are not supported: {format_spec}")
+
+
+def plan_bulk_rename(is2_files, pattern, tier_rows=None):
+    """
+    Computes the new name of every file in memory from a single listing of the
+    folder. Files are taken in capture order (Date Modified), mapped in order onto
+    tier_rows (if given) and named with pattern, e.g. "{tier1} {tier2} - {seq:03}".
+    Available fields are tier1..tierN, location (all tiers joined), seq (1-based)
+    and original (old file stem). Returns a list of (old_path, new_path).
+    """
+    if not is2_files:
+        return []
+    if pattern:
+        _check_pattern(pattern)
+    folder = is2_files[0].parent
+    with os.scandir(folder) as entries:
+        listing = {entry.name: entry.stat().st_mtime for entry in entries}
+
+    rows = list(tier_rows or [])
+    in_capture_order = sorted(is2_files, key=lambda f: listing.get(f.name, 0))
+    planned = in_capture_order[:len(rows)] if rows else in_capture_order
+
+    # Files being renamed give up their current names, everything else is taken
+    sources = {f.name.lower() for f in planned}
+    taken = {name.lower() for name in listing} - sources
+
+    plan = []
+    for seq, original_file in enumerate(planned, start=1):
+        row = rows[seq - 1] if rows else ()
+        fields = _PatternFields((f"tier{i + 1}", part) for i, part in enumerate(row))
+        fields["location"] = " ".join(row)
+        fields["seq"] = seq
+        fields["original"] = original_file.stem
+
+        base_name = pattern.format_map(fields) if pattern else fields["location"]
+        base_name = _INVALID_NAME_CHARS.sub("", base_name).strip()
+        if not base_name:
+            raise ValueError(f"Pattern gives an empty name for {original_file.name}")
+
+        candidate = f"{base_name}.is2"
+        suffix_num = 2
+        while candidate.lower() in taken:
+            candidate = f"{base_name}({suffix_num}).is2"
+            suffix_num += 1
+        taken.add(candidate.lower())
+        plan.append((original_file, folder / candidate))
+    return plan
+
+
+def export_visible_from_is2(is2_filepath, export_path):
+    """
+    Writes the visible image straight out of the .is2 archive, picking the same
+    member as get_visible_thumbnail without extracting the archive to disk.
+    """
+    with zipfile.ZipFile(is2_filepath, 'r') as zf:
+        jpgs = [info for info in zf.infolist()
+                if info.filename.rpartition('/')[0].lower() == "images/main"
+                and info.filename.lower().endswith('.jpg')]
+        if not jpgs:
+            return False
+        smallest = min(jpgs, key=lambda info: info.file_size)
+        with zf.open(smallest) as src, open(export_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+    return True
+
+
+def _write_rename_journal(journal, phase, staged):
+    renames = [[tmp.name, src.name, dst.name] for tmp, src, dst in staged]
+    journal.write_text(json.dumps({"phase": phase, "renames": renames}, indent=1), encoding="utf-8")
+
+
+def recover_bulk_rename(folder, finish=False):
+    """
+    Finishes or rolls back a bulk rename that was interrupted, using the journal
+    apply_bulk_rename left in folder. Every file is either at its old name, its
+    temporary name or (once placing started) its new name.
+    """
+    journal = Path(folder) / RENAME_JOURNAL_NAME
+    data = json.loads(journal.read_text(encoding="utf-8"))
+    staged = [(journal.parent / tmp, journal.parent / src, journal.parent / dst)
+              for tmp, src, dst in data["renames"]]
+    placing = data["phase"] == "placing"
+
+    if finish:
+        if not placing:
+            for tmp, src, _ in staged:
+                if not tmp.exists():
+                    src.rename(tmp)
+        for tmp, _, dst in staged:
+            if tmp.exists():
+                tmp.rename(dst)
+    else:
+        if placing:
+            for tmp, _, dst in staged:
+                if not tmp.exists():
+                    dst.rename(tmp)
+        for tmp, src, _ in staged:
+            if tmp.exists():
+                tmp.rename(src)
+    journal.unlink()
+
+
+def apply_bulk_rename(plan, export_visible=False):
+    """
+    Applies a plan from plan_bulk_rename in one batched pass.
+    Files are staged through temporary names so a target may reuse another file's
+    old name. Every step is journaled next to the files first; if a rename fails
+    the batch is rolled back, and if that fails too (RenameRecoveryError) or the
+    app dies mid-way recover_bulk_rename can finish or undo it from the journal.
+    Returns (exported, missing): exported maps each .jpg to its capture time for
+    set_windows_creation_time, missing lists renamed files with no visible image.
+    """
+    if not plan:
+        return {}, []
+    folder = plan[0][0].parent
+    journal = folder / RENAME_JOURNAL_NAME
+    if journal.exists():
+        raise RenameRecoveryError("This folder has an unfinished bulk rename.")
+    staged = [(folder / f"~is2tool_{os.getpid()}_{i}.tmp", src, dst)
+              for i, (src, dst) in enumerate(plan) if src != dst]
+
+    if staged:
+        _write_rename_journal(journal, "staging", staged)
+        try:
+            for tmp, src, _ in staged:
+                src.rename(tmp)
+            _write_rename_journal(journal, "placing", staged)
+            for tmp, _, dst in staged:
+                tmp.rename(dst)
+        except Exception as e:
+            try:
+                recover_bulk_rename(folder)
+            except Exception as rollback_error:
+                # Journal is kept so the folder can be finished or rolled back later
+                raise RenameRecoveryError(f"{e}\nRolling back also failed: {rollback_error}") from e
+            raise
+        journal.unlink()
+
+    exported, missing = {}, []
+    if export_visible:
+        for _, new_file in plan:
+            export_path = new_file.with_suffix(".jpg")
+            try:
+                found = export_visible_from_is2(new_file, export_path)
+            except (OSError, zipfile.BadZipFile):
+                found = False
+            if found:
+                exported[export_path] = datetime.fromtimestamp(new_file.stat().st_mtime)
+            else:
+                missing.append(new_file)
+    return exported, missing
+
+
+# v2.2 - repack .is2 archives to save space
+def _jpeg_app1_segments(data):
+    # APP1 holds the EXIF (capture date, orientation) and XMP blocks
+    segments = []
+    i = 2
+    while i + 4 <= len(data) and data[i] == 0xFF:
+        marker = data[i + 1]
+        if marker == 0xDA:  # Start of scan, no more headers
+            break
+        length = int.from_bytes(data[i + 2:i + 4], 'big')
+        if marker == 0xE1:
+            segments.append(data[i:i + 2 + length])
+        i += 2 + length
+    return segments
+
+
+def _downscale_jpeg(data, max_side, quality=85):
+    image = QImage.fromData(data, "JPG")
+    if image.isNull() or max(image.width(), image.height()) <= max_side:
+        return data
+    image = image.scaled(max_side, max_side, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    buffer = QBuffer()
+    buffer.open(QIODevice.WriteOnly)
+    image.save(buffer, "JPG", quality)
+    out = bytes(buffer.data())
+
+    # Qt drops the EXIF block on re-encode, so carry it over after the SOI/JFIF header
+    insert_at = 2
+    if out[2:4] == b"\xff\xe0":
+        insert_at += 2 + int.from_bytes(out[4:6], 'big')
+    return out[:insert_at] + b"".join(_jpeg_app1_segments(data)) + out[insert_at:]
+
+
+def repack_is2(is2_filepath, photo_note_max_side=0):
+    """
+    Rewrites one .is2 archive with duplicate members dropped and, if photo_note_max_side
+    is set, the full-size photo notes downscaled. Member order, names, timestamps and
+    the IR/visible images are kept so Fluke software and the thumbnail getters still work.
+    The file is only replaced (atomically) when the result is smaller.
+    Returns (path, old_size, new_size).
+    """
+    is2_filepath = Path(is2_filepath)
+    stat = is2_filepath.stat()
+
+    with zipfile.ZipFile(is2_filepath, 'r') as zf:
+        # A repeated name keeps its first position but the last entry's data, same as zf.read(name)
+        latest = {}
+        for info in zf.infolist():
+            latest[info.filename] = info
+        members = list(latest.values())
+
+        # Largest jpg in each PhotoNotes/<n>/ is the full image, the smallest is its thumbnail
+        full_notes = {}
+        if photo_note_max_side:
+            notes = {}
+            for info in members:
+                parts = info.filename.split('/')
+                if len(parts) == 3 and parts[0].lower() == "photonotes" and parts[2].lower().endswith('.jpg'):
+                    notes.setdefault(parts[1], []).append(info)
+            for infos in notes.values():
+                by_size = sorted(infos, key=lambda x: x.file_size)
+                full_notes[by_size[-1].filename] = by_size[0].file_size if len(by_size) > 1 else 0
+
+        fd, tmp_name = tempfile.mkstemp(prefix="~is2tool_", suffix=".tmp", dir=is2_filepath.parent)
+        os.close(fd)
+        tmp = Path(tmp_name)
+        try:
+            with zipfile.ZipFile(tmp, 'w') as out:
+                out.comment = zf.comment
+                for info in members:
+                    data = zf.read(info)
+                    if info.filename in full_notes:
+                        smaller = _downscale_jpeg(data, photo_note_max_side)
+                        # Must stay bigger than its thumbnail or get_photonotes_thumbnails swaps them
+                        if full_notes[info.filename] < len(smaller) < len(data):
+                            data = smaller
+                    new_info = zipfile.ZipInfo(info.filename, info.date_time)
+                    new_info.compress_type = info.compress_type
+                    new_info.create_system = info.create_system
+                    new_info.external_attr = info.external_attr
+                    new_info.comment = info.comment
+                    out.writestr(new_info, data)
+
+            new_size = tmp.stat().st_size
+            if new_size >= stat.st_size:
+                tmp.unlink()
+                return is2_filepath, stat.st_size, stat.st_size
+
+            os.utime(tmp, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            try:
+                set_windows_creation_time(tmp, datetime.fromtimestamp(stat.st_ctime))
+            except Exception:
+                pass  # Date Created can be fixed later from the Tools menu
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    # Outside the with block so the source archive is closed before it is replaced
+    try:
+        os.replace(tmp, is2_filepath)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return is2_filepath, stat.st_size, new_size
+
+
+def repack_folder(folder, photo_note_max_side=0, workers=None, progress=None):
+    """
+    Runs repack_is2 over every .is2 file in folder with a process pool.
+    progress(done, total) is called as files finish; returning True cancels the
+    files that have not started yet. Files already being repacked still finish
+    and are included in the results.
+    Returns (results, failed, elapsed_seconds) where failed is a list of (path, error).
+    """
+    files = [f for f in Path(folder).iterdir() if f.suffix.lower() == ".is2"]
+    results, failed = [], []
+    collected = set()
+
+    def collect(future):
+        collected.add(future)
+        try:
+            results.append(future.result())
+        except Exception as e:
+            failed.append((futures[future], e))
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(repack_is2, f, photo_note_max_side): f for f in files}
+        if progress:
+            progress(0, len(files))
+        for future in as_completed(futures):
+            collect(future)
+            if progress and progress(len(collected), len(files)):
+                pool.shutdown(cancel_futures=True)
+                break
+
+    # After a cancel the pool still waits for started files, which have replaced their archives
+    for future in futures:
+        if future not in collected and future.done() and not future.cancelled():
+            collect(future)
+    return results, failed, time.perf_counter() - start
+
+
 class HomeScreen(QWidget):
     def __init__(self, on_start_callback):
         super().__init__()
@@ -238,6 +565,97 @@ class ZoomWindow(QDialog):
         self.image_label.resize(scaled_pixmap.size())
 
 
+class BulkRenameDialog(QDialog):
+    def __init__(self, is2_files, tier_rows, export_visible):
+        super().__init__()
+        self.setWindowTitle("Bulk Rename")
+        self.setMinimumSize(700, 500)
+        self.is2_files = is2_files
+        self.tier_rows = tier_rows
+        self.plan = []
+        self.exported = {}
+        self.missing = []
+        self.needs_recovery = False
+
+        layout = QVBoxLayout()
+
+        self.pattern_field = QLineEdit()
+        self.pattern_field.setPlaceholderText("Pattern, e.g. {tier1} {tier2} - {seq:03}  (blank = location only)")
+        self.pattern_field.textChanged.connect(self.clear_preview)
+        layout.addWidget(self.pattern_field)
+
+        self.use_rows_checkbox = QCheckBox(f"Map files onto imported location rows ({len(tier_rows)} rows)")
+        self.use_rows_checkbox.setChecked(bool(tier_rows))
+        self.use_rows_checkbox.setEnabled(bool(tier_rows))
+        self.use_rows_checkbox.toggled.connect(self.clear_preview)
+        layout.addWidget(self.use_rows_checkbox)
+
+        self.export_visible_checkbox = QCheckBox("Export Visible Image")
+        self.export_visible_checkbox.setChecked(export_visible)
+        layout.addWidget(self.export_visible_checkbox)
+
+        self.preview_box = QPlainTextEdit()
+        self.preview_box.setReadOnly(True)
+        self.preview_box.setLineWrapMode(QPlainTextEdit.NoWrap)
+        layout.addWidget(self.preview_box)
+
+        button_row = QHBoxLayout()
+        self.preview_button = QPushButton("Preview")
+        self.preview_button.clicked.connect(self.build_preview)
+        button_row.addWidget(self.preview_button)
+
+        self.apply_button = QPushButton("Apply")
+        self.apply_button.clicked.connect(self.apply_plan)
+        self.apply_button.setEnabled(False)
+        button_row.addWidget(self.apply_button)
+        layout.addLayout(button_row)
+
+        self.setLayout(layout)
+
+    def clear_preview(self):
+        self.plan = []
+        self.apply_button.setEnabled(False)
+        self.preview_box.clear()
+
+    def build_preview(self):
+        rows = self.tier_rows if self.use_rows_checkbox.isChecked() else None
+        pattern = self.pattern_field.text().strip()
+        if not pattern and not rows:
+            QMessageBox.warning(self, "Missing Input", "Please enter a pattern or use the location rows.")
+            return
+        try:
+            self.plan = plan_bulk_rename(self.is2_files, pattern, rows)
+        except (ValueError, IndexError, KeyError, AttributeError, TypeError) as e:
+            self.clear_preview()
+            QMessageBox.warning(self, "Invalid Pattern", f"Could not build names:\n{e}")
+            return
+
+        changed = [f"{src.name}  ->  {dst.name}" for src, dst in self.plan if src != dst]
+        lines = [f"{len(changed)} of {len(self.is2_files)} files will be renamed."]
+        if len(self.plan) < len(self.is2_files):
+            lines.append(f"{len(self.is2_files) - len(self.plan)} files have no matching location row and are left as-is.")
+        lines.append("")
+        self.preview_box.setPlainText("\n".join(lines + changed))
+        self.apply_button.setEnabled(bool(self.plan))
+
+    def apply_plan(self):
+        try:
+            self.exported, self.missing = apply_bulk_rename(self.plan, self.export_visible_checkbox.isChecked())
+        except RenameRecoveryError as e:
+            QMessageBox.critical(self, "Rename Error",
+                                 f"Bulk rename failed and the folder needs recovery:\n{e}")
+            self.needs_recovery = True
+            self.reject()
+            return
+        except Exception as e:
+            QMessageBox.critical(self, "Rename Error", f"Bulk rename failed and was rolled back:\n{e}")
+            return
+        if self.missing:
+            QMessageBox.warning(self, "Export Failed",
+                                f"No visible image found to export for {len(self.missing)} files.")
+        self.accept()
+
+
 class ImageReviewApp(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -334,6 +752,7 @@ class ImageReviewApp(QMainWindow):
         self.extract_dir = None
         self.extract_dirs = []
         self.exported_images = {}  # v1.5 dictionary to track exported images
+        self.tier_rows = []  # v2.1 location rows in sheet order, for bulk rename
 
     def show_main_tool(self):
         self.stacked_layout.setCurrentWidget(self.main_tool_widget)
@@ -347,6 +766,8 @@ class ImageReviewApp(QMainWindow):
         if not folder_path:
             return
         folder = Path(folder_path)
+        if (folder / RENAME_JOURNAL_NAME).exists():
+            self.recover_interrupted_rename(folder)
         all_files = [f for f in folder.iterdir() if f.suffix.lower() == ".is2"]
         if self.filter_checkbox.isChecked():
             all_files = [f for f in all_files if f.name.startswith("IR_")]
@@ -364,6 +785,21 @@ class ImageReviewApp(QMainWindow):
         self.current_index = 0
         self.show_current_file()
 
+    def recover_interrupted_rename(self, folder):
+        box = QMessageBox(QMessageBox.Warning, "Interrupted Bulk Rename",
+                          "A bulk rename in this folder did not finish.\n"
+                          "Finish it, or roll the files back to their old names?", parent=self)
+        finish_button = box.addButton("Finish Renaming", QMessageBox.AcceptRole)
+        rollback_button = box.addButton("Roll Back", QMessageBox.DestructiveRole)
+        box.addButton(QMessageBox.Cancel)
+        box.exec_()
+        if box.clickedButton() not in (finish_button, rollback_button):
+            return
+        try:
+            recover_bulk_rename(folder, finish=box.clickedButton() is finish_button)
+        except Exception as e:
+            QMessageBox.critical(self, "Rename Error", f"Failed to recover the interrupted rename:\n{e}")
+
     def import_locations(self):
         file_path, _ = QFileDialog.getOpenFileName(self, "Select Locations Excel File", "", "Excel Files (*.xlsx)")
         if not file_path:
@@ -372,10 +808,12 @@ class ImageReviewApp(QMainWindow):
         sheet = wb.active
 
         self.tier_tree = {}
+        self.tier_rows = []
         for row in sheet.iter_rows(min_row=2, values_only=True):
             non_empty = [str(cell).strip() for cell in row if cell and str(cell).strip()]
             if not non_empty:
                 continue
+            self.tier_rows.append(tuple(non_empty))
             current = self.tier_tree
             for level in non_empty:
                 current = current.setdefault(level, {})
@@ -608,6 +1046,74 @@ class ImageReviewApp(QMainWindow):
 
         QMessageBox.information(self, "Done", f"Updated Date Created on {updated} .is2 files.")
 
+    def bulk_rename(self):
+        if not self.is2_files:
+            QMessageBox.information(self, "No Files", "No .is2 files loaded. Select a folder first.")
+            return
+
+        dialog = BulkRenameDialog(self.is2_files, self.tier_rows, self.export_visible_checkbox.isChecked())
+        if dialog.exec_() != QDialog.Accepted:
+            if dialog.needs_recovery:
+                self.recover_interrupted_rename(self.is2_files[0].parent)
+                self.refresh_is2_list()
+                self.current_index = 0
+                self.show_current_file()
+            return
+
+        renamed = {src: dst for src, dst in dialog.plan if src != dst}
+        self.is2_files = [renamed.get(f, f) for f in self.is2_files]
+        self.exported_images.update(dialog.exported)
+        QMessageBox.information(self, "Done", f"Renamed {len(renamed)} .is2 files.")
+        self.show_current_file()
+
+    def repack_archives(self):
+        folder_path = QFileDialog.getExistingDirectory(self, "Select Folder to Repack")
+        if not folder_path:
+            return
+        max_side, ok = QInputDialog.getInt(
+            self, "Repack .is2 Files",
+            "Downscale photo notes to longest side in pixels (0 = keep full resolution):",
+            1600, 0, 20000, 100)
+        if not ok:
+            return
+
+        progress_dialog = QProgressDialog("Repacking .is2 files...", "Cancel", 0, 0, self)
+        progress_dialog.setWindowTitle("Repack .is2 Files")
+        progress_dialog.setWindowModality(Qt.WindowModal)
+        progress_dialog.setMinimumDuration(0)
+
+        cancelled = False
+
+        def on_progress(done, total):
+            nonlocal cancelled
+            progress_dialog.setMaximum(total)
+            progress_dialog.setValue(done)
+            QApplication.processEvents()
+            cancelled = progress_dialog.wasCanceled()
+            return cancelled
+
+        try:
+            results, failed, elapsed = repack_folder(folder_path, max_side, progress=on_progress)
+        finally:
+            progress_dialog.close()
+
+        total_in = sum(old for _, old, _ in results)
+        saved = sum(old - new for _, old, new in results)
+        repacked = sum(1 for _, old, new in results if new < old)
+        throughput = total_in / elapsed / 1e6 if elapsed else 0
+        summary = QMessageBox(
+            QMessageBox.Warning if failed else QMessageBox.Information,
+            "Cancelled" if cancelled else "Done",
+            f"Repacked {repacked} of {len(results)} .is2 files.\n"
+            f"Saved {saved / 1e6:.1f} MB of {total_in / 1e6:.1f} MB "
+            f"({throughput:.1f} MB/s, {elapsed:.1f} s).\n"
+            f"{len(failed)} files failed.",
+            parent=self
+        )
+        if failed:
+            summary.setDetailedText("\n".join(f"{path.name}: {error}" for path, error in failed))
+        summary.exec_()
+
     def create_menu_bar(self):
         menubar = self.menuBar()
 
@@ -634,6 +1140,16 @@ class ImageReviewApp(QMainWindow):
         set_dates_action.triggered.connect(self.set_created_dates_for_all)
         tools_menu.addAction(set_dates_action)
 
+        # Action: Bulk rename from location rows or a pattern
+        bulk_rename_action = QAction("Bulk Rename...", self)
+        bulk_rename_action.triggered.connect(self.bulk_rename)
+        tools_menu.addAction(bulk_rename_action)
+
+        # Action: Repack .is2 archives
+        repack_action = QAction("Repack .is2 Files...", self)
+        repack_action.triggered.connect(self.repack_archives)
+        tools_menu.addAction(repack_action)
+
         # --- Options Menu ---
         tools_menu = menubar.addMenu("Options")
         # Checkable: Only show unrenamed files
@@ -673,4 +1189,5 @@ def main():
     sys.exit(app.exec_())
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Repack workers in the PyInstaller exe
     main()